@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败（包括超过 slow_call_threshold 的慢调用）达到 failure_threshold 次后打开，
+    打开期间直接抛出 CircuitOpenError；recovery_timeout 秒后进入半开，
+    只放行一个探测调用，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=10, slow_call_threshold=0.5):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = 0
+            self._probe_in_flight = False
+            self._set_state(CLOSED)
+
+    @property
+    def state(self):
+        with self._lock:
+            # 打开超时后进入半开，等待下一个调用去探测，同时更新指标
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self._set_state(HALF_OPEN)
+            return self._state
+
+    def add_listener(self, listener):
+        """注册状态变化回调 listener(old_state, new_state)"""
+        self._listeners.append(listener)
+
+    def call(self, func, *args, **kwargs):
+        """通过熔断器调用 func"""
+        if not self._allow_request():
+            raise CircuitOpenError(f"{self.name} 熔断中")
+
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._on_failure()
+            raise
+        if time.monotonic() - start > self.slow_call_threshold:
+            self._on_failure()
+        else:
+            self._on_success()
+        return result
+
+    def _allow_request(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._set_state(HALF_OPEN)
+            # 半开：同一时间只放行一个探测调用
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def _on_success(self):
+        with self._lock:
+            if self._state == OPEN:
+                # 打开之前发出的调用迟到的成功，不能据此关闭
+                return
+            self._failures = 0
+            self._probe_in_flight = False
+            old_state = self._set_state(CLOSED)
+        self._notify(old_state, CLOSED)
+
+    def _on_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                old_state = self._set_state(OPEN)
+            else:
+                old_state = self._state
+            new_state = self._state
+        self._notify(old_state, new_state)
+
+    def _set_state(self, state):
+        """切换状态并更新指标，返回旧状态，需持有锁"""
+        old_state = getattr(self, '_state', None)
+        self._state = state
+        if old_state != state:
+            if metrics.CIRCUIT_STATE is not None:
+                metrics.CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+                metrics.CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        return old_state
+
+    def _notify(self, old_state, new_state):
+        if old_state == new_state:
+            return
+        if new_state == OPEN:
+            logger.error(f"{self.name} 熔断器打开")
+        else:
+            logger.warning(f"{self.name} 熔断器状态 {old_state} -> {new_state}")
+        for listener in self._listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                logger.error(f"熔断器回调失败: {e}")
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'state': self.state,
+            'failures': self._failures,
+        }
@@ -0,0 +1,268 @@
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+# 当前请求ID，由 RequestIdMiddleware 设置
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def set_request_id(request_id):
+    """设置当前请求ID，返回用于恢复的token"""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """给日志记录附加请求ID"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = get_request_id()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """重复错误限流去重
+
+    同一logger、同一级别、同一消息在 period 秒内最多输出 burst 条，
+    其余丢弃并计数，窗口结束后的第一条记录带上 suppressed 字段
+    """
+
+    def __init__(self, period=60, burst=5, min_level='WARNING', max_keys=1000):
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        self.min_level = logging._checkLevel(min_level)
+        self.max_keys = max_keys
+        self._windows = {}  # key -> [窗口开始时间, 已输出数, 已丢弃数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._evict(now)
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+    def _evict(self, now):
+        """清理过期窗口，仍然超限时清空"""
+        expired = [k for k, w in self._windows.items() if now - w[0] >= self.period]
+        for k in expired:
+            del self._windows[k]
+        if len(self._windows) >= self.max_keys:
+            self._windows.clear()
+
+
+class SamplingFilter(logging.Filter):
+    """高频低级别日志采样，max_level 及以下的记录按 rate 比例保留"""
+
+    def __init__(self, rate=0.1, max_level='INFO'):
+        super().__init__()
+        self.rate = rate
+        self.max_level = logging._checkLevel(max_level)
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON格式日志，一行一条"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueLogHandler(logging.Handler):
+    """非阻塞日志处理器
+
+    请求线程只把记录放进有界队列，后台线程批量写入滚动日志文件，
+    文件写入和滚动都不会发生在请求线程里。队列满时丢弃并计数，不阻塞请求
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8',
+                 queue_size=10000, batch_size=200, flush_interval=0.5):
+        super().__init__()
+        self.target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding
+        )
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # 延迟到第一条日志再启动线程，fork之后在子进程里重新启动
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def emit(self, record):
+        try:
+            self._ensure_started()
+            record = self.prepare(record)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """与 QueueHandler.prepare 相同，复制记录后固定消息和异常文本
+
+        不修改其它处理器共用的记录，入队的副本也不再引用异常的栈帧
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                formatter = self.formatter or logging.Formatter()
+                record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    self.queue.task_done()
+
+    def _dropped_record(self):
+        dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return None
+        record = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            f"日志队列已满，丢弃 {dropped} 条日志", None, None
+        )
+        record.request_id = '-'
+        return record
+
+    def _write_batch(self, batch):
+        """一批记录一次写入，只在批末flush"""
+        records = list(batch)
+        dropped = self._dropped_record()
+        if dropped is not None:
+            records.append(dropped)
+        if not records:
+            return
+        target = self.target
+        target.acquire()
+        try:
+            if target.stream is None:
+                # 退出时 logging.shutdown 可能先关闭了目标文件
+                target.stream = target._open()
+            for record in records:
+                try:
+                    msg = self.format(record) + target.terminator
+                    # 与 RotatingFileHandler.shouldRollover 相同的判断，避免重复格式化
+                    if target.maxBytes > 0 and target.stream.tell() + len(msg) >= target.maxBytes:
+                        target.doRollover()
+                    target.stream.write(msg)
+                except Exception:
+                    self.handleError(record)
+            target.flush()
+        finally:
+            target.release()
+
+    def flush(self):
+        """等待队列中的记录写完"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + 5
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self.queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+            thread.join(timeout=5)
+        self._thread = None
+        self.target.close()
+        super().close()
@@ -0,0 +1,109 @@
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import F
+
+from articles.models import Article
+from articles.sharded_counter import ShardedViewCounter
+
+
+class Command(BaseCommand):
+    help = "并发压测同一篇文章的阅读计数，对比直接更新文章行和分片计数的锁等待与吞吐"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='并发线程数')
+        parser.add_argument('--writes', type=int, default=200, help='每个线程写入次数')
+        parser.add_argument('--shards', type=int, default=16, help='分片数')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench_view_counters')
+        article = Article.objects.create(title='计数压测', author=user)
+        try:
+            # 阈值为1，第一次写入就启用分片
+            counters = [
+                ('直接更新文章行', None),
+                ('分片计数', ShardedViewCounter(shards=options['shards'], promote_threshold=1, merge_interval=3600)),
+            ]
+            for name, counter in counters:
+                result = self._run(article.id, counter, options['threads'], options['writes'])
+                self._report(name, result)
+                if counter is not None:
+                    counter.merge(article.id)
+
+            article.refresh_from_db()
+            expected = options['threads'] * options['writes'] * 2
+            self.stdout.write(f"校验: 文章行 total_views={article.total_views}，期望 {expected}")
+        finally:
+            article.delete()
+
+    def _run(self, article_id, counter, threads, writes):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads + 1)
+
+        def worker():
+            local = []
+            try:
+                barrier.wait()
+                for _ in range(writes):
+                    start = time.perf_counter()
+                    with transaction.atomic():
+                        if counter is None:
+                            Article.objects.filter(id=article_id).update(total_views=F('total_views') + 1)
+                        else:
+                            counter.increment(article_id)
+                    local.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(local)
+
+        lock_before = self._row_lock_status()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in workers:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        lock_after = self._row_lock_status()
+
+        result = {'elapsed': elapsed, 'latencies': latencies, 'errors': errors}
+        if lock_before and lock_after:
+            result['lock_waits'] = lock_after['Innodb_row_lock_waits'] - lock_before['Innodb_row_lock_waits']
+            result['lock_time_ms'] = lock_after['Innodb_row_lock_time'] - lock_before['Innodb_row_lock_time']
+        return result
+
+    @staticmethod
+    def _row_lock_status():
+        """InnoDB 行锁等待统计，非 MySQL 返回 None"""
+        if connection.vendor != 'mysql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%%'")
+            return {name: int(value) for name, value in cursor.fetchall()}
+
+    def _report(self, name, result):
+        latencies = sorted(result['latencies'])
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        if not latencies:
+            self.stdout.write(f"  全部失败: {result['errors'][:1]}")
+            return
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(f"  写入 {len(latencies)} 次，耗时 {result['elapsed']:.2f}s，"
+                          f"吞吐 {len(latencies) / result['elapsed']:.0f} 次/秒")
+        self.stdout.write(f"  延迟 中位数 {statistics.median(latencies) * 1000:.2f}ms，p99 {p99 * 1000:.2f}ms")
+        if 'lock_waits' in result:
+            self.stdout.write(f"  行锁等待 {result['lock_waits']} 次，共 {result['lock_time_ms']}ms")
+        else:
+            self.stdout.write("  行锁等待统计仅支持 MySQL")
+        if result['errors']:
+            self.stdout.write(self.style.ERROR(f"  失败 {len(result['errors'])} 个线程: {result['errors'][0]}"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from articles.sharded_counter import ShardedViewCounter
+
+
+class Command(BaseCommand):
+    help = "把所有阅读计数分片合并回文章行，可由定时任务执行"
+
+    def handle(self, *args, **options):
+        merged = ShardedViewCounter.merge_all()
+        self.stdout.write(f"合并了 {merged} 篇文章的计数分片")
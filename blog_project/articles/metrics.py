@@ -0,0 +1,14 @@
+"""运行指标，安装了 prometheus_client 时导出，否则只保留进程内数值"""
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, generate_latest
+except ImportError:  # prometheus_client 是可选依赖
+    CONTENT_TYPE_LATEST = Counter = Gauge = generate_latest = None
+
+
+if Gauge is not None:
+    CIRCUIT_STATE = Gauge('circuit_breaker_state', '熔断器状态：0关闭 1半开 2打开', ['name'])
+    CIRCUIT_TRANSITIONS = Counter('circuit_breaker_transitions', '熔断器状态切换次数', ['name', 'state'])
+    BUFFERED_VIEWS = Gauge('stats_buffered_views', '本地缓冲中待回放的阅读数')
+else:
+    CIRCUIT_STATE = CIRCUIT_TRANSITIONS = BUFFERED_VIEWS = None
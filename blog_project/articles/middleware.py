@@ -1,7 +1,29 @@
+import uuid
+
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
+from .logging_pipeline import set_request_id, reset_request_id
+
+
+class RequestIdMiddleware:
+    """为每个请求分配请求ID，写入日志并通过响应头返回"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # 优先沿用上游传入的请求ID
+        request_id = request.META.get('HTTP_X_REQUEST_ID') or uuid.uuid4().hex
+        request.request_id = request_id[:64]
+        token = set_request_id(request.request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_request_id(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
 class JWTAuthenticationMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
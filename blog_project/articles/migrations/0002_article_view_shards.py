@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('articles', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleViewShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='分片号')),
+                ('total_views', models.IntegerField(default=0, verbose_name='未合并阅读量')),
+                ('unique_visitors', models.IntegerField(default=0, verbose_name='未合并访客数')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_shards', to='articles.article', verbose_name='文章')),
+            ],
+            options={
+                'verbose_name': '文章阅读计数分片',
+                'verbose_name_plural': '文章阅读计数分片',
+                'db_table': 't_article_view_shards',
+                'unique_together': {('article', 'shard')},
+            },
+        ),
+    ]
@@ -37,4 +37,21 @@ class ArticleViewRecord(models.Model):
         unique_together = ('article', 'user')  # 确保每个用户对每篇文章只有一条记录
 
     def __str__(self):
-        return f"{self.article.title}-{self.user.username}"
\ No newline at end of file
+        return f"{self.article.title}-{self.user.username}"
+
+class ArticleViewShard(models.Model):
+    """热门文章阅读计数分片，阅读量分散写入多行，读取时求和"""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='view_shards', verbose_name="文章")
+    shard = models.PositiveSmallIntegerField(verbose_name='分片号')
+    total_views = models.IntegerField(default=0, verbose_name="未合并阅读量")
+    unique_visitors = models.IntegerField(default=0, verbose_name="未合并访客数")
+
+    class Meta:
+        db_table = 't_article_view_shards'
+        verbose_name = '文章阅读计数分片'
+        verbose_name_plural = '文章阅读计数分片'
+        unique_together = ('article', 'shard')
+
+    def __str__(self):
+        return f"{self.article_id}-{self.shard}"
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Article, ArticleViewShard
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedViewCounter:
+    """热门文章分片计数
+
+    每篇文章在本进程内统计写入速率，window 秒内写入达到 promote_threshold 次即视为热门，
+    热门状态保持 hold 秒。热门文章的阅读随机累加到 shards 个分片行上，
+    避免所有写入排队等待 t_articles 同一行的行锁；分片每 merge_interval 秒合并回文章行一次。
+    非热门文章每个统计窗口检查一次是否有重启或其它进程留下的分片，有才加锁合并；
+    不再有阅读的文章由 merge_view_shards 命令合并。读取时文章行加上分片之和才是准确值
+    """
+
+    def __init__(self, shards=16, promote_threshold=20, window=1, hold=60, merge_interval=5, max_articles=10000):
+        self.shards = shards
+        self.promote_threshold = promote_threshold
+        self.window = window
+        self.hold = hold
+        self.merge_interval = merge_interval
+        self.max_articles = max_articles
+        self._windows = {}  # article_id -> [窗口开始时间, 写入次数]
+        self._hot_until = {}  # article_id -> 热门状态截止时间
+        self._last_merge = {}  # article_id -> 上次合并时间
+        self._lock = threading.Lock()
+
+    def is_hot(self, article_id):
+        with self._lock:
+            return self._hot_until.get(article_id, 0) > time.monotonic()
+
+    def _record_write(self, article_id):
+        """记录一次写入，返回 (是否热门, 是否需要合并分片)"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(article_id)
+            new_window = window is None or now - window[0] >= self.window
+            if new_window:
+                if window is None and len(self._windows) >= self.max_articles:
+                    self._windows.clear()
+                window = self._windows[article_id] = [now, 0]
+            window[1] += 1
+
+            if window[1] >= self.promote_threshold:
+                if article_id not in self._hot_until:
+                    logger.warning(f"文章 {article_id} 写入过快，启用分片计数")
+                    self._last_merge[article_id] = now
+                self._hot_until[article_id] = now + self.hold
+
+            hot_until = self._hot_until.get(article_id)
+            if hot_until is None:
+                # 分片可能由其它进程或重启前写入，每个窗口检查合并一次
+                return False, new_window
+            if hot_until <= now:
+                # 热门状态结束，最后合并一次
+                del self._hot_until[article_id]
+                self._last_merge.pop(article_id, None)
+                return False, True
+            if now - self._last_merge[article_id] >= self.merge_interval:
+                self._last_merge[article_id] = now
+                return True, True
+            return True, False
+
+    def increment(self, article_id, views=1, visitors=0):
+        """累加阅读量和访客数，需要在事务中调用，返回是否需要合并分片"""
+        hot, need_merge = self._record_write(article_id)
+        if not hot:
+            Article.objects.filter(id=article_id).update(
+                total_views=F('total_views') + views,
+                unique_visitors=F('unique_visitors') + visitors
+            )
+            # 先用不加锁的查询确认有未合并的分片，避免普通文章每次都加锁合并
+            return need_merge and self.has_pending(article_id)
+
+        shard = random.randrange(self.shards)
+        updated = ArticleViewShard.objects.filter(article_id=article_id, shard=shard).update(
+            total_views=F('total_views') + views,
+            unique_visitors=F('unique_visitors') + visitors
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ArticleViewShard.objects.create(
+                        article_id=article_id, shard=shard, total_views=views, unique_visitors=visitors
+                    )
+            except IntegrityError:
+                # 分片行被并发创建
+                ArticleViewShard.objects.filter(article_id=article_id, shard=shard).update(
+                    total_views=F('total_views') + views,
+                    unique_visitors=F('unique_visitors') + visitors
+                )
+        return need_merge
+
+    @staticmethod
+    def merge(article_id):
+        """把分片合并回文章行"""
+        try:
+            with transaction.atomic():
+                shards = list(
+                    ArticleViewShard.objects.select_for_update()
+                    .filter(article_id=article_id)
+                    .values_list('id', 'total_views', 'unique_visitors')
+                )
+                views = sum(s[1] for s in shards)
+                visitors = sum(s[2] for s in shards)
+                if not views and not visitors:
+                    return
+                ArticleViewShard.objects.filter(id__in=[s[0] for s in shards]).update(
+                    total_views=0, unique_visitors=0
+                )
+                Article.objects.filter(id=article_id).update(
+                    total_views=F('total_views') + views,
+                    unique_visitors=F('unique_visitors') + visitors
+                )
+        except Exception as e:
+            logger.error(f"合并计数分片失败: {e}")
+
+    @staticmethod
+    def merge_all():
+        """合并所有还有未合并计数的分片，返回处理的文章数"""
+        article_ids = list(
+            ArticleViewShard.objects.exclude(total_views=0, unique_visitors=0)
+            .values_list('article_id', flat=True).distinct()
+        )
+        for article_id in article_ids:
+            ShardedViewCounter.merge(article_id)
+        return len(article_ids)
+
+    @staticmethod
+    def with_current_counts(queryset):
+        """附加 current_views / current_visitors：文章行加上未合并的分片，一次查询读取"""
+        return queryset.annotate(
+            current_views=F('total_views') + Coalesce(Sum('view_shards__total_views'), 0),
+            current_visitors=F('unique_visitors') + Coalesce(Sum('view_shards__unique_visitors'), 0),
+        )
+
+    @staticmethod
+    def has_pending(article_id):
+        """是否有尚未合并回文章行的分片"""
+        return ArticleViewShard.objects.filter(article_id=article_id).exclude(
+            total_views=0, unique_visitors=0
+        ).exists()
+
+    @staticmethod
+    def pending(article_id):
+        """尚未合并回文章行的 (阅读量, 访客数)"""
+        stats = ArticleViewShard.objects.filter(article_id=article_id).aggregate(
+            total_views=Sum('total_views'),
+            unique_visitors=Sum('unique_visitors')
+        )
+        return stats['total_views'] or 0, stats['unique_visitors'] or 0
@@ -1,3 +1,411 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from . import metrics
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitOpenError
+from .logging_pipeline import (
+    JsonFormatter, QueueLogHandler, RateLimitFilter, RequestIdFilter, SamplingFilter,
+    get_request_id, reset_request_id, set_request_id,
+)
+from .models import Article, ArticleViewRecord, ArticleViewShard
+from .sharded_counter import ShardedViewCounter
+from .views_status import ViewStatsService, _stale_stats, redis_breaker, view_buffer
+
+
+# 测试期间不把 articles 日志写入 logs/django_dev.log
+_silence_logs = mock.patch.object(logging.getLogger('articles'), 'handlers', [logging.NullHandler()])
+
+
+def setUpModule():
+    _silence_logs.start()
+
+
+def tearDownModule():
+    _silence_logs.stop()
+
+
+def make_record(msg='出错了', level=logging.ERROR, name='articles.views_status'):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    """日志管道"""
+
+    def test_rate_limit_suppresses_repeated_errors(self):
+        log_filter = RateLimitFilter(period=60, burst=2)
+        results = [log_filter.filter(make_record()) for _ in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        # 不同消息不受影响
+        self.assertTrue(log_filter.filter(make_record('另一个错误')))
+        # 低于 min_level 的记录不限流
+        self.assertTrue(all(log_filter.filter(make_record(level=logging.INFO)) for _ in range(5)))
+
+    def test_rate_limit_reports_suppressed_count(self):
+        log_filter = RateLimitFilter(period=0.05, burst=1)
+        for _ in range(4):
+            log_filter.filter(make_record())
+        log_filter._windows[next(iter(log_filter._windows))][0] -= 1
+        record = make_record()
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.suppressed, 3)
+
+    def test_sampling_only_affects_low_levels(self):
+        log_filter = SamplingFilter(rate=0)
+        self.assertFalse(log_filter.filter(make_record(level=logging.INFO)))
+        self.assertTrue(log_filter.filter(make_record(level=logging.ERROR)))
+
+    def test_json_output_with_request_id(self):
+        token = set_request_id('abc123')
+        try:
+            record = make_record()
+            RequestIdFilter().filter(record)
+        finally:
+            reset_request_id(token)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['request_id'], 'abc123')
+        self.assertEqual(data['level'], 'ERROR')
+        self.assertEqual(data['message'], '出错了')
+
+    def test_queue_handler_does_not_modify_shared_record(self):
+        handler = QueueLogHandler(os.devnull)
+        try:
+            try:
+                raise ValueError('坏数据')
+            except ValueError:
+                record = logging.LogRecord('articles', logging.ERROR, __file__, 1, '失败 %s', (1,), None)
+                record.exc_info = sys.exc_info()
+            prepared = handler.prepare(record)
+        finally:
+            handler.close()
+        self.assertEqual((record.msg, record.args), ('失败 %s', (1,)))
+        self.assertIsNotNone(record.exc_info)
+        self.assertEqual((prepared.msg, prepared.args, prepared.exc_info), ('失败 1', None, None))
+        self.assertIn('ValueError: 坏数据', prepared.exc_text)
+
+    def test_async_db_update_keeps_request_id(self):
+        seen = []
+        token = set_request_id('req-1')
+        try:
+            with mock.patch.object(ViewStatsService, '_update_database',
+                                   side_effect=lambda *args: seen.append(get_request_id())):
+                ViewStatsService._delay_db_update(1, 1)
+                for _ in range(100):
+                    if seen:
+                        break
+                    time.sleep(0.01)
+        finally:
+            reset_request_id(token)
+        self.assertEqual(seen, ['req-1'])
+
+    def test_queue_handler_writes_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test.log')
+            handler = QueueLogHandler(filename, maxBytes=200, backupCount=2, flush_interval=0.01)
+            handler.setFormatter(JsonFormatter())
+            handler.addFilter(RequestIdFilter())
+            try:
+                for i in range(20):
+                    handler.handle(make_record(f'记录 {i}'))
+                handler.flush()
+                self.assertEqual(handler.queue.unfinished_tasks, 0)
+                self.assertTrue(os.path.exists(filename + '.1'))
+            finally:
+                handler.close()
+
+
+class FakeRedisCache:
+    """本地Redis替身，可以模拟延迟和宕机"""
+
+    def __init__(self):
+        self.data = {}
+        self.latency = 0
+        self.down = False
+        self.calls = 0
+
+    def _op(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.down:
+            raise ConnectionError('Redis 不可用')
+
+    def get(self, key, default=None):
+        self._op()
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self._op()
+        self.data[key] = value
+
+    def has_key(self, key):
+        self._op()
+        return key in self.data
+
+    def incr(self, key, delta=1):
+        self._op()
+        self.data[key] += delta
+        return self.data[key]
+
+    def expire(self, key, timeout):
+        self._op()
+
+    def sadd(self, key, *members):
+        self._op()
+        self.data.setdefault(key, set()).update(members)
+
+    def scard(self, key):
+        self._op()
+        return len(self.data.get(key, ()))
+
+
+class RedisCircuitBreakerTests(TestCase):
+    """Redis变慢或宕机时的熔断与本地缓冲"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='test123')
+        self.article = Article.objects.create(title='测试文章', author=self.user)
+        self.fake_cache = FakeRedisCache()
+
+        breaker_config = (redis_breaker.failure_threshold, redis_breaker.recovery_timeout,
+                          redis_breaker.slow_call_threshold)
+        redis_breaker.failure_threshold = 2
+        redis_breaker.recovery_timeout = 60
+        redis_breaker.slow_call_threshold = 0.05
+        redis_breaker.reset()
+        view_buffer.drain()
+        _stale_stats.clear()
+
+        def restore():
+            (redis_breaker.failure_threshold, redis_breaker.recovery_timeout,
+             redis_breaker.slow_call_threshold) = breaker_config
+            redis_breaker.reset()
+            view_buffer.drain()
+
+        self.addCleanup(restore)
+        # 测试中同步执行数据库更新和回放
+        for patcher in (
+            mock.patch('articles.views_status.cache', self.fake_cache),
+            mock.patch.object(ViewStatsService, '_delay_db_update', ViewStatsService._update_database),
+            mock.patch.object(ViewStatsService, '_delay_replay', ViewStatsService.replay_buffer),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def expire_open_state(self):
+        redis_breaker._opened_at -= redis_breaker.recovery_timeout
+
+    def view_count(self):
+        record = ArticleViewRecord.objects.filter(article=self.article, user=self.user).first()
+        return record.view_count if record else 0
+
+    def test_outage_opens_circuit_and_buffers_views(self):
+        self.fake_cache.down = True
+        # 前两次失败直接写数据库，随后熔断
+        ViewStatsService.record_view(self.article.id, self.user.id)
+        ViewStatsService.record_view(self.article.id, self.user.id)
+        self.assertEqual(redis_breaker.state, OPEN)
+        self.assertEqual(self.view_count(), 2)
+
+        calls = self.fake_cache.calls
+        for _ in range(3):
+            self.assertTrue(ViewStatsService.record_view(self.article.id, self.user.id))
+        # 熔断期间不再访问Redis，阅读进入本地缓冲
+        self.assertEqual(self.fake_cache.calls, calls)
+        self.assertEqual(view_buffer.pending_user_views(self.article.id, self.user.id), 3)
+        self.assertEqual(self.view_count(), 2)
+
+        # 统计从数据库读取并加上缓冲中的阅读
+        stats = ViewStatsService.get_article_stats(self.article.id)
+        self.assertEqual(stats['total_views'], 5)
+        self.assertFalse(stats['from_cache'])
+        self.assertEqual(ViewStatsService.get_user_views(self.article.id, self.user.id), 5)
+        self.assertEqual(self.fake_cache.calls, calls)
+
+    def test_recovery_probe_closes_circuit_and_replays_buffer(self):
+        self.fake_cache.down = True
+        for _ in range(5):
+            ViewStatsService.record_view(self.article.id, self.user.id)
+        self.assertEqual(len(view_buffer), 1)
+
+        # 半开探测仍然失败，重新熔断
+        self.expire_open_state()
+        self.assertEqual(redis_breaker.state, HALF_OPEN)
+        ViewStatsService.record_view(self.article.id, self.user.id)
+        self.assertEqual(redis_breaker.state, OPEN)
+
+        # Redis恢复后探测成功，关闭并回放缓冲
+        self.fake_cache.down = False
+        self.expire_open_state()
+        ViewStatsService.record_view(self.article.id, self.user.id)
+        self.assertEqual(redis_breaker.state, CLOSED)
+        self.assertEqual(len(view_buffer), 0)
+        self.assertEqual(self.view_count(), 7)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 7)
+        # 缓存中是探测请求的1次加上回放的3次
+        user_key = f'article:{self.article.id}:user:{self.user.id}:views'
+        self.assertEqual(self.fake_cache.data[user_key], 4)
+
+    def test_view_buffered_after_recovery_is_replayed(self):
+        # 请求拿到 CircuitOpenError 后，熔断器在写入缓冲前已经恢复
+        with mock.patch.object(redis_breaker, 'call', side_effect=CircuitOpenError):
+            self.assertTrue(ViewStatsService.record_view(self.article.id, self.user.id))
+        self.assertEqual(redis_breaker.state, CLOSED)
+        self.assertEqual(len(view_buffer), 0)
+        self.assertEqual(self.view_count(), 1)
+
+    def test_slow_redis_fails_fast(self):
+        self.fake_cache.latency = 0.06
+        ViewStatsService.get_article_stats(self.article.id)
+        ViewStatsService.get_article_stats(self.article.id)
+        self.assertEqual(redis_breaker.state, OPEN)
+
+        start = time.monotonic()
+        for _ in range(5):
+            ViewStatsService.record_view(self.article.id, self.user.id)
+            ViewStatsService.get_article_stats(self.article.id)
+        self.assertLess(time.monotonic() - start, 0.06)
+
+    def test_stale_stats_when_database_unavailable(self):
+        self.fake_cache.down = True
+        Article.objects.filter(id=self.article.id).update(total_views=8, unique_visitors=3)
+        stats = ViewStatsService.get_article_stats(self.article.id)
+        self.assertFalse(stats['stale'])
+
+        with mock.patch.object(ShardedViewCounter, 'with_current_counts', side_effect=Exception('数据库不可用')):
+            stats = ViewStatsService.get_article_stats(self.article.id)
+        self.assertTrue(stats['stale'])
+        self.assertEqual(stats['total_views'], 8)
+        self.assertEqual(stats['unique_visitors'], 3)
+
+    @skipIf(metrics.Gauge is None, '未安装 prometheus_client')
+    def test_breaker_state_metric(self):
+        from prometheus_client import REGISTRY
+        self.fake_cache.down = True
+        for _ in range(2):
+            ViewStatsService.get_user_views(self.article.id, self.user.id)
+        value = REGISTRY.get_sample_value('circuit_breaker_state', {'name': 'stats_redis'})
+        self.assertEqual(value, 2)
+
+        # 打开超时后读取状态即导出半开
+        self.expire_open_state()
+        self.assertEqual(redis_breaker.state, HALF_OPEN)
+        value = REGISTRY.get_sample_value('circuit_breaker_state', {'name': 'stats_redis'})
+        self.assertEqual(value, 1)
+
+
+class ShardedViewCounterTests(TestCase):
+    """热门文章分片计数"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='test123')
+        self.article = Article.objects.create(title='热门文章', author=self.user)
+        self.counter = ShardedViewCounter(shards=4, promote_threshold=3, window=60, hold=60, merge_interval=60)
+
+    def increment(self, times, visitors=0):
+        for _ in range(times):
+            self.counter.increment(self.article.id, 1, visitors)
+
+    def test_cold_article_updates_article_row(self):
+        self.increment(2, visitors=1)
+        self.assertFalse(self.counter.is_hot(self.article.id))
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 2)
+        self.assertEqual(self.article.unique_visitors, 2)
+        self.assertFalse(ArticleViewShard.objects.exists())
+
+    def test_hot_article_spreads_writes_across_shards(self):
+        self.increment(50)
+        self.assertTrue(self.counter.is_hot(self.article.id))
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 2)
+        self.assertLessEqual(ArticleViewShard.objects.filter(article=self.article).count(), 4)
+        self.assertEqual(self.counter.pending(self.article.id), (48, 0))
+
+        self.counter.merge(self.article.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 50)
+        self.assertEqual(self.counter.pending(self.article.id), (0, 0))
+
+    def test_merge_after_interval_and_demotion(self):
+        counter = ShardedViewCounter(shards=4, promote_threshold=3, window=1, hold=10, merge_interval=5)
+        clock = [100.0]
+        with mock.patch('articles.sharded_counter.time.monotonic', lambda: clock[0]):
+            # 同一窗口内第3次写入升级为热门；此前没有分片，冷写入不合并
+            results = [counter.increment(self.article.id) for _ in range(3)]
+            self.assertEqual(results, [False, False, False])
+            self.assertTrue(counter.is_hot(self.article.id))
+
+            clock[0] += 2
+            self.assertFalse(counter.increment(self.article.id))
+            # 距上次合并超过 merge_interval
+            clock[0] += 3
+            self.assertTrue(counter.increment(self.article.id))
+            self.assertTrue(counter.is_hot(self.article.id))
+
+            # hold 过后写入速率回落，降级并最后合并一次
+            clock[0] += 20
+            self.assertTrue(counter.increment(self.article.id))
+            self.assertFalse(counter.is_hot(self.article.id))
+
+    def test_orphaned_shards_merged_by_another_process(self):
+        with mock.patch('articles.views_status.view_counter', self.counter):
+            for _ in range(30):
+                ViewStatsService._update_database(self.article.id, self.user.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 2)
+        self.assertEqual(self.counter.pending(self.article.id), (28, 0))
+
+        # 进程重启后新的计数器写入冷文章，合并之前留下的分片
+        with mock.patch('articles.views_status.view_counter', ShardedViewCounter(promote_threshold=100)):
+            ViewStatsService._update_database(self.article.id, self.user.id)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 31)
+        self.assertEqual(self.counter.pending(self.article.id), (0, 0))
+
+    def test_cold_write_without_shards_does_not_merge(self):
+        with mock.patch('articles.views_status.view_counter', self.counter), \
+                mock.patch.object(ShardedViewCounter, 'merge') as merge, \
+                CaptureQueriesContext(connection) as queries:
+            ViewStatsService._update_database(self.article.id, self.user.id)
+        merge.assert_not_called()
+        shard_queries = [q['sql'] for q in queries if 't_article_view_shards' in q['sql']]
+        self.assertEqual(len(shard_queries), 1)
+        self.assertNotIn('FOR UPDATE', shard_queries[0])
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 1)
+
+    def test_merge_command_sweeps_idle_articles(self):
+        self.increment(10)
+        self.assertEqual(self.counter.pending(self.article.id), (8, 0))
+        call_command('merge_view_shards', stdout=io.StringIO())
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.total_views, 10)
+        self.assertEqual(self.counter.pending(self.article.id), (0, 0))
+
+    def test_article_list_includes_unmerged_shards(self):
+        self.increment(10, visitors=1)
+        article = ShardedViewCounter.with_current_counts(Article.objects.filter(id=self.article.id)).get()
+        self.assertEqual((article.total_views, article.current_views), (2, 10))
+        self.assertEqual((article.unique_visitors, article.current_visitors), (2, 10))
+
+    def test_stats_include_unmerged_shards(self):
+        with mock.patch('articles.views_status.view_counter', self.counter), \
+                mock.patch('articles.views_status.cache', FakeRedisCache()):
+            for _ in range(10):
+                ViewStatsService._update_database(self.article.id, self.user.id)
+            stats = ViewStatsService.get_article_stats(self.article.id)
+        self.assertEqual(stats['total_views'], 10)
+        self.assertEqual(stats['unique_visitors'], 1)
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
-from .views import LoginPageView, LogoutView, ArticleListView, ArticleDetailView
+from .views import LoginPageView, LogoutView, ArticleListView, ArticleDetailView, MetricsView
 
 urlpatterns = [
     
@@ -10,6 +10,7 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('articles/', ArticleListView.as_view(), name='article_list'),
     path('articles/<int:article_id>/', ArticleDetailView.as_view(), name='article_detail'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     
     # JWT认证接口
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
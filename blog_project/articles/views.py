@@ -1,15 +1,17 @@
 from django.shortcuts import render, get_object_or_404
 from django.db import transaction
 from django.db.models import Sum, Count
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.core.cache import cache
 
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny,IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from . import metrics
 from .models import Article, ArticleViewRecord
-from .views_status import ViewStatsService
+from .sharded_counter import ShardedViewCounter
+from .views_status import ViewStatsService, redis_breaker, view_buffer
 
 class LoginPageView(APIView):
     """登录页面"""
@@ -25,13 +27,28 @@ class LogoutView(APIView):
     def get(self, request):
         return JsonResponse({'success': True})
 
+class MetricsView(APIView):
+    """运行指标"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        # 读取一次状态，打开超时的熔断器先切换到半开再导出
+        redis_breaker.state
+        if metrics.generate_latest is not None:
+            return HttpResponse(metrics.generate_latest(), content_type=metrics.CONTENT_TYPE_LATEST)
+        # 未安装 prometheus_client 时返回JSON
+        return JsonResponse({
+            'circuit_breaker': redis_breaker.snapshot(),
+            'buffered_keys': len(view_buffer),
+        })
+
 class ArticleListView(APIView):
     """文章列表页"""
     permission_classes = [AllowAny]
     
     def get(self, request):
         #查询所有文章并返回
-        articles = Article.objects.all().order_by('-created_at')
+        articles = ShardedViewCounter.with_current_counts(Article.objects.all()).order_by('-created_at')
         return render(request, 'article_list.html', {
             'articles': articles,
             'is_authenticated': request.user.is_authenticated
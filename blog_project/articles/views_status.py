@@ -1,56 +1,170 @@
+import contextvars
 import threading
 import logging
-import threading
+from collections import Counter, OrderedDict
 
+from django.conf import settings
 from django.core.cache import cache
 from django.db import transaction
 from django.db.models import F
-from django.db.models import Sum, Count
 
+from . import metrics
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
 from .models import Article, ArticleViewRecord
+from .sharded_counter import ShardedViewCounter
 
 logger = logging.getLogger(__name__)
 
+# 统计用Redis的熔断器，参数见 settings.STATS_REDIS_BREAKER
+redis_breaker = CircuitBreaker('stats_redis', **getattr(settings, 'STATS_REDIS_BREAKER', {}))
+
+
+class LocalViewBuffer:
+    """熔断期间的本地阅读缓冲，按(文章, 用户)合并计数，恢复后回放"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._views = Counter()  # (article_id, user_id) -> 阅读数
+        self._article_views = Counter()  # article_id -> 阅读数
+        self._lock = threading.Lock()
+
+    def add(self, article_id, user_id):
+        """记录一次阅读，缓冲已满返回False"""
+        key = (article_id, user_id)
+        with self._lock:
+            if key not in self._views and len(self._views) >= self.max_keys:
+                return False
+            self._views[key] += 1
+            self._article_views[article_id] += 1
+            self._update_metric()
+            return True
+
+    def drain(self):
+        """取出全部缓冲的阅读"""
+        with self._lock:
+            views = self._views
+            self._views = Counter()
+            self._article_views = Counter()
+            self._update_metric()
+        return views
+
+    def pending_user_views(self, article_id, user_id):
+        return self._views.get((article_id, user_id), 0)
+
+    def pending_article_views(self, article_id):
+        return self._article_views.get(article_id, 0)
+
+    def __len__(self):
+        return len(self._views)
+
+    def _update_metric(self):
+        if metrics.BUFFERED_VIEWS is not None:
+            metrics.BUFFERED_VIEWS.set(sum(self._article_views.values()))
+
+
+view_buffer = LocalViewBuffer(**getattr(settings, 'STATS_VIEW_BUFFER', {}))
+
+# 文章阅读计数，热门文章自动分片，参数见 settings.STATS_SHARDED_COUNTER
+view_counter = ShardedViewCounter(**getattr(settings, 'STATS_SHARDED_COUNTER', {}))
+
+# 最近一次成功获取的文章统计，Redis和数据库都不可用时返回
+_stale_stats = OrderedDict()
+_stale_stats_lock = threading.Lock()
+STALE_STATS_MAX = 1000
+
+
+def _save_stale_stats(article_id, stats):
+    with _stale_stats_lock:
+        _stale_stats[article_id] = stats
+        _stale_stats.move_to_end(article_id)
+        if len(_stale_stats) > STALE_STATS_MAX:
+            _stale_stats.popitem(last=False)
+
+
 class ViewStatsService:
     """阅读统计"""
     @staticmethod
     def record_view(article_id,user_id):
         """记录阅读 先写缓存 异步更新数据库"""
         try:
-            # 生成缓存键
-            user_key = f'article:{article_id}:user:{user_id}:views'
-            total_key = f'article:{article_id}:total_views'
-            unique_key = f'article:{article_id}:unique_visitors'
-
-            #缓存更新用户阅读数
-            user_view = cache.get(user_key,0) + 1
-            cache.set(user_key,user_view,timeout=60*60)
-
-            #缓存更新总阅读量
-            total_view = cache.incr(total_key) if cache.has_key(total_key) else 1
-            if total_view == 1:
-                #如果是新键则设置过期时间
-                cache.expire(total_key, timeout=60*60)
-
-            # 缓存更新独立访客,集合实现
-            cache.sadd(unique_key, user_id)
-            cache.expire(unique_key, timeout=60*60)
+            redis_breaker.call(ViewStatsService._cache_view, article_id, user_id)
 
             # 异步更新数据库
             ViewStatsService._delay_db_update(article_id, user_id)
             return True
-    
+
+        except CircuitOpenError:
+            # 熔断中：写入本地缓冲，恢复后回放，不等待Redis超时
+            if view_buffer.add(article_id, user_id):
+                # 写入缓冲前熔断器可能已经恢复并完成回放，此时需要再回放一次
+                if redis_breaker.state == CLOSED:
+                    ViewStatsService._delay_replay()
+                return True
+            logger.error("阅读缓冲已满")
+            return ViewStatsService._update_database(article_id, user_id)
+
         except Exception as e:
             logger.error(f"记录阅读失败: {e}")
             # 降级：直接写数据库
             return ViewStatsService._update_database(article_id, user_id)
-        
+
+    @staticmethod
+    def _cache_view(article_id, user_id, views=1):
+        """缓存中记录阅读"""
+        # 生成缓存键
+        user_key = f'article:{article_id}:user:{user_id}:views'
+        total_key = f'article:{article_id}:total_views'
+        unique_key = f'article:{article_id}:unique_visitors'
+
+        #缓存更新用户阅读数
+        user_view = cache.get(user_key,0) + views
+        cache.set(user_key,user_view,timeout=60*60)
+
+        #缓存更新总阅读量
+        total_view = cache.incr(total_key, views) if cache.has_key(total_key) else views
+        if total_view == views:
+            #如果是新键则设置过期时间
+            cache.expire(total_key, timeout=60*60)
+
+        # 缓存更新独立访客,集合实现
+        cache.sadd(unique_key, user_id)
+        cache.expire(unique_key, timeout=60*60)
+
+    @staticmethod
+    def _on_breaker_change(old_state, new_state):
+        """熔断器恢复后回放本地缓冲"""
+        if new_state == CLOSED and len(view_buffer):
+            ViewStatsService._delay_replay()
+
+    @staticmethod
+    def _delay_replay():
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(ViewStatsService.replay_buffer,))
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def replay_buffer():
+        """把本地缓冲的阅读回放到Redis和数据库"""
+        views = view_buffer.drain()
+        if views:
+            logger.warning(f"回放缓冲阅读 {sum(views.values())} 次")
+        for (article_id, user_id), count in views.items():
+            try:
+                redis_breaker.call(ViewStatsService._cache_view, article_id, user_id, count)
+            except Exception as e:
+                # Redis再次失败时只写数据库，缓存由 get_article_stats 回填
+                logger.error(f"回放缓存失败: {e}")
+            ViewStatsService._update_database(article_id, user_id, count)
+
     @staticmethod
     def _delay_db_update(article_id, user_id):
         """延迟更新数据库"""
         try:
-            #通过线程模拟异步
-            thread = threading.Thread(target=ViewStatsService._update_database,args=(article_id, user_id))
+            #通过线程模拟异步，复制上下文使日志带上当前请求ID
+            thread = threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(ViewStatsService._update_database, article_id, user_id)
+            )
             thread.daemon = True #守护线程
             thread.start()
 
@@ -59,87 +173,121 @@ class ViewStatsService:
             ViewStatsService._update_database(article_id, user_id)
 
     @staticmethod
-    def _update_database(article_id, user_id):
+    def _update_database(article_id, user_id, views=1):
         """更新数据库"""
         try:
             with transaction.atomic():
                 view_record,create = ArticleViewRecord.objects.get_or_create(
                     article_id=article_id,
                     user_id=user_id,
-                    defaults={'view_count': 1}
+                    defaults={'view_count': views}
                 )
                 if not create:
-                    view_record.view_count = F('view_count') + 1 #F对象避免竞争
+                    view_record.view_count = F('view_count') + views #F对象避免竞争
                     view_record.save(update_fields=['view_count'])
                 
-                # 更新文章总统计
-                ViewStatsService._update_article_stats(article_id)
-                
+                # 更新文章总统计，热门文章写入计数分片
+                need_merge = view_counter.increment(article_id, views, 1 if create else 0)
+
+            if need_merge:
+                view_counter.merge(article_id)
             return True
         except Exception as e:
             logger.error(f"数据库更新失败: {e}")
             return False
     
-    @staticmethod
-    def _update_article_stats(article_id):
-        try:
-            stats = ArticleViewRecord.objects.filter(article_id=article_id).aggregate(
-                total_views=Sum('view_count'),
-                unique_visitors=Count('user_id', distinct=True)
-            )
-            Article.objects.filter(id=article_id).update(
-                total_views=stats['total_views'] or 0,
-                unique_visitors=stats['unique_visitors'] or 0
-            )
-        except Exception as e:
-            logger.error(f"更新文章统计失败: {e}")
-            return False
-        
     @staticmethod
     def get_article_stats(article_id):
         """获取文章统计信息"""
+        total_key = f'article:{article_id}:total_views'
+        unique_key = f'article:{article_id}:unique_visitors'
+        redis_ok = True
+
         try:
             #先从缓存中获取
-            total_key = f'article:{article_id}:total_views'
-            unique_key = f'article:{article_id}:unique_visitors'
-
-            total_views = cache.get(total_key)
-            unique_visitors = cache.scard(unique_key) if cache.has_key(unique_key) else None
-
-            cache_hit = total_views is not None and unique_visitors is not None
+            total_views, unique_visitors = redis_breaker.call(
+                ViewStatsService._get_cached_stats, total_key, unique_key
+            )
+            if total_views is not None and unique_visitors is not None:
+                stats = {
+                    'total_views': total_views or 0,
+                    'unique_visitors': unique_visitors or 0,
+                    'from_cache': True,
+                    'stale': False,
+                }
+                _save_stale_stats(article_id, stats)
+                return stats
+        except CircuitOpenError:
+            redis_ok = False
+        except Exception as e:
+            logger.error(f"获取缓存统计失败: {e}")
+            redis_ok = False
 
-            if not cache_hit:
-                #缓存未命中，从数据库中获取
-                article = Article.objects.get(id=article_id)
-                total_views = article.total_views
-                unique_visitors = article.unique_visitors
+        try:
+            #缓存未命中或Redis不可用，从数据库中获取
+            #文章行和尚未合并的计数分片在同一条查询中读取，避免中途合并导致少计
+            article = ShardedViewCounter.with_current_counts(Article.objects.filter(id=article_id)).get()
+            total_views = article.current_views
+            unique_visitors = article.current_visitors
 
+            if redis_ok:
                 #回填缓存
-                cache.set(total_key, total_views, timeout=60*60)
-                if unique_visitors > 0:
-                    cache.set(unique_key, unique_visitors, 60*30)
+                try:
+                    redis_breaker.call(
+                        ViewStatsService._backfill_stats, total_key, unique_key, total_views, unique_visitors
+                    )
+                except Exception as e:
+                    logger.error(f"回填缓存失败: {e}")
+            else:
+                #加上本地缓冲中尚未回放的阅读
+                total_views += view_buffer.pending_article_views(article_id)
 
-            return {
+            stats = {
                 'total_views': total_views or 0,
                 'unique_visitors': unique_visitors or 0,
-                'from_cache': cache_hit
+                'from_cache': False,
+                'stale': False,
             }
-            
+            _save_stale_stats(article_id, stats)
+            return stats
+
         except Exception as e:
             logger.error(f"获取统计失败: {e}")
-            return {'total_views': 0, 'unique_visitors': 0, 'from_cache': False}
-        
+            stale = _stale_stats.get(article_id)
+            if stale is not None:
+                return {**stale, 'from_cache': False, 'stale': True}
+            return {'total_views': 0, 'unique_visitors': 0, 'from_cache': False, 'stale': False}
+
+    @staticmethod
+    def _get_cached_stats(total_key, unique_key):
+        total_views = cache.get(total_key)
+        unique_visitors = cache.scard(unique_key) if cache.has_key(unique_key) else None
+        return total_views, unique_visitors
+
+    @staticmethod
+    def _backfill_stats(total_key, unique_key, total_views, unique_visitors):
+        cache.set(total_key, total_views, timeout=60*60)
+        if unique_visitors > 0:
+            cache.set(unique_key, unique_visitors, 60*30)
+
     @staticmethod
     def get_user_views(article_id, user_id):
         """"获取用户阅读数"""
+        user_key = f'article:{article_id}:user:{user_id}:views'
+        redis_ok = True
         try:
             #查缓存
-            user_key = f'article:{article_id}:user:{user_id}:views'
-            cache_views = cache.get(user_key)
+            cache_views = redis_breaker.call(cache.get, user_key)
 
             if cache_views is not None:
                 return int(cache_views)
+        except CircuitOpenError:
+            redis_ok = False
+        except Exception as e:
+            logger.error(f"获取缓存用户阅读数失败: {e}")
+            redis_ok = False
 
+        try:
             #未命中，查数据库
             view_record = ArticleViewRecord.objects.filter(
                 article_id=article_id,
@@ -148,12 +296,20 @@ class ViewStatsService:
 
             views = view_record.view_count if view_record else 0
 
-            #回填
-            cache.set(user_key, views, timeout=60*60)   
-            
+            if redis_ok:
+                #回填
+                try:
+                    redis_breaker.call(cache.set, user_key, views, timeout=60*60)
+                except Exception as e:
+                    logger.error(f"回填缓存失败: {e}")
+            else:
+                views += view_buffer.pending_user_views(article_id, user_id)
+
             return views
         
         except Exception as e:
             logger.error(f"获取用户阅读数失败: {e}")
             return 0
-        
\ No newline at end of file
+
+
+redis_breaker.add_listener(ViewStatsService._on_breaker_change)
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'articles.middleware.RequestIdMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -166,13 +167,42 @@ CACHES = {
         'LOCATION': 'redis://127.0.0.1:6379/1',
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-            'SOCKET_CONNECT_TIMEOUT': 5,
-            'SOCKET_TIMEOUT': 5,
-            'RETRY_ON_TIMEOUT': True,
+            #超时过长会让每个请求都等Redis，故障由熔断器兜底
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+            'RETRY_ON_TIMEOUT': False,
         }
     }
 }
 
+#阅读统计Redis熔断器
+STATS_REDIS_BREAKER = {
+    #连续失败（含慢调用）多少次后熔断
+    'failure_threshold': 5,
+    #熔断多少秒后放行一个探测请求
+    'recovery_timeout': 10,
+    #超过多少秒的调用算作失败
+    'slow_call_threshold': 0.5,
+}
+
+#熔断期间本地阅读缓冲，最多缓存多少个(文章, 用户)
+STATS_VIEW_BUFFER = {
+    'max_keys': 10000,
+}
+
+#热门文章分片计数
+STATS_SHARDED_COUNTER = {
+    #每篇热门文章的分片行数
+    'shards': 16,
+    #window秒内写入达到多少次视为热门
+    'promote_threshold': 20,
+    'window': 1,
+    #热门状态保持秒数
+    'hold': 60,
+    #分片合并回文章行的间隔秒数
+    'merge_interval': 5,
+}
+
 # 缓存超时设置
 CACHE_TTL = 60 * 15
 
@@ -189,12 +219,31 @@ LOGGING = {
             "format": "{levelname} {message}",
             "style": "{",
         },
+        #JSON格式，一行一条，包含请求ID
+        "json": {
+            "()": "articles.logging_pipeline.JsonFormatter",
+        },
     },
     #日志的过滤信息
     "filters": {
         "require_debug_true": {
             "()": "django.utils.log.RequireDebugTrue",
         }, #DEBUG = True 时，相关的日志记录才会被处理。
+        #附加请求ID
+        "request_id": {
+            "()": "articles.logging_pipeline.RequestIdFilter",
+        },
+        #重复错误限流去重：同一条错误60秒内最多记录5条
+        "rate_limit": {
+            "()": "articles.logging_pipeline.RateLimitFilter",
+            "period": 60,
+            "burst": 5,
+        },
+        #INFO及以下日志采样
+        "sampling": {
+            "()": "articles.logging_pipeline.SamplingFilter",
+            "rate": 1.0 if DEBUG else 0.1,
+        },
     },
     #日志的处理方式
     "handlers": {
@@ -206,14 +255,21 @@ LOGGING = {
         },
         "file":{
             "level":"INFO",
-            "class":"logging.handlers.RotatingFileHandler",
+            #请求线程只入队，后台线程批量写文件和滚动
+            "()":"articles.logging_pipeline.QueueLogHandler",
             "filename":os.path.join(os.path.dirname(BASE_DIR),'logs/django_dev.log'),
             #日志文件最大值
             "maxBytes":1024*1024*3,
             #日志文件的数量
             "backupCount":5,
-            #日志格式：详细
-            "formatter":"verbose",
+            #队列长度，满了丢弃不阻塞请求
+            "queue_size":10000,
+            #每批最多写入条数和最长等待秒数
+            "batch_size":200,
+            "flush_interval":0.5,
+            "filters": ["request_id", "rate_limit", "sampling"],
+            #日志格式：JSON
+            "formatter":"json",
         }
     },
     #日志的入口
@@ -222,5 +278,10 @@ LOGGING = {
             "handlers": ["console","file"],
             "propagate": True, #是否让其它日志处理器处理
         },
+        "articles": {
+            "handlers": ["console","file"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }